@@ -1,36 +1,191 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Form
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
 from typing import Optional, List
+from anyio import CapacityLimiter, to_thread
+from contextlib import contextmanager
+from cachetools import TTLCache
 import duckdb
+import gzip
+import hashlib
+import itertools
+import logging
 import os
 import jwt
-from datetime import datetime, timedelta
+import orjson
 import secrets
+import threading
+import time
 
-app = FastAPI(title="ETL Analytics API", version="1.0")
+app = FastAPI(title="ETL Analytics API", version="1.0", default_response_class=ORJSONResponse)
+logger = logging.getLogger(__name__)
 
 # Config
 DB_PATH = os.getenv("DB_PATH", "data/etl.db")
 JWT_SECRET = os.getenv("JWT_SECRET", secrets.token_urlsafe(32))
+TOKEN_TTL_SECONDS = 24 * 60 * 60
+# Seconds a write waits for in-flight reads before giving up with 503
+DB_WRITE_WAIT = int(os.getenv("DB_WRITE_WAIT", 10))
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", 1000))
+# DuckDB worker threads / memory cap shared by all concurrent API queries
+DB_THREADS = int(os.getenv("DB_THREADS", os.cpu_count() or 1))
+DB_MEMORY_LIMIT = os.getenv("DB_MEMORY_LIMIT")  # e.g. "4GB"; DuckDB's default when unset
+# Rows per Arrow record batch when streaming list endpoints
+STREAM_BATCH_SIZE = 500
+# Seconds a KPI payload is served from cache (KPI tables only change on ETL runs)
+KPI_CACHE_TTL = int(os.getenv("KPI_CACHE_TTL", 60))
+# Worker threads for sync handlers, and how many KPI queries may hit DuckDB at once
+# (DuckDB already parallelizes each query internally)
+API_THREADPOOL_SIZE = int(os.getenv("API_THREADPOOL_SIZE", 200))
+KPI_DB_CONCURRENCY = int(os.getenv("KPI_DB_CONCURRENCY", 8))
 
 security = HTTPBearer()
 
+# Verified token payloads, keyed by a hash of the token. Entries live for a few
+# seconds so repeated calls skip the HMAC check; invalid tokens are cached too.
+_TOKEN_CACHE = TTLCache(maxsize=10000, ttl=5)
+_TOKEN_CACHE_LOCK = threading.Lock()
+_INVALID_TOKEN = object()
+
 class LoginRequest(BaseModel):
     username: str
     password: str
 
-def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    """Verify JWT token"""
-    try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=["HS256"])
-        return payload
-    except:
+async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Verify JWT token (recently verified tokens are served from cache)"""
+    token = credentials.credentials
+    key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+    with _TOKEN_CACHE_LOCK:
+        payload = _TOKEN_CACHE.get(key)
+    if payload is None:
+        try:
+            payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+        except jwt.InvalidTokenError:
+            payload = _INVALID_TOKEN
+        with _TOKEN_CACHE_LOCK:
+            _TOKEN_CACHE[key] = payload
+    # A cached payload must not outlive the token's own expiry
+    if payload is _INVALID_TOKEN or payload.get("exp", float("inf")) < time.time():
         raise HTTPException(status_code=401, detail="Invalid token")
+    return payload
+
+# Shared read-only DuckDB connection, opened once at startup. Each request works on
+# its own cursor (a thread-safe sibling of the connection). Read-only only takes a
+# shared file lock, so generate_charts can read the database while the API is up.
+# A write waits for in-flight reads, swaps in a read-write connection for its own
+# statements and closes it again; the next read reopens the read-only one.
+# DuckDB calls block, so handlers that query it stay plain `def`: FastAPI runs those
+# in its threadpool instead of on the event loop.
+_CONN = None
+_DB_STATE = threading.Condition()
+_DB_READERS = 0
+_DB_WRITING = False
+_WRITE_LOCK = threading.Lock()
+
+def connect_db(read_only=True):
+    """Open DB_PATH (read-only unless a write needs it)"""
+    db_config = {"threads": DB_THREADS}
+    if DB_MEMORY_LIMIT:
+        db_config["memory_limit"] = DB_MEMORY_LIMIT
+    return duckdb.connect(DB_PATH, read_only=read_only, config=db_config)
+
+@app.on_event("startup")
+def open_db():
+    """Open the shared read-only DuckDB connection"""
+    global _CONN
+    _CONN = connect_db()
 
-def get_db():
-    """Get DuckDB connection"""
-    return duckdb.connect(DB_PATH)
+@app.on_event("startup")
+async def configure_threadpool():
+    """Size the AnyIO threadpool and the KPI query limiter"""
+    global _KPI_LIMITER
+    to_thread.current_default_thread_limiter().total_tokens = API_THREADPOOL_SIZE
+    _KPI_LIMITER = CapacityLimiter(KPI_DB_CONCURRENCY)
+
+@app.on_event("shutdown")
+def close_db():
+    """Close the shared DuckDB connection"""
+    if _CONN is not None:
+        _CONN.close()
+
+def begin_read():
+    """Register an in-flight read and return the shared connection (reopened after a write)"""
+    global _CONN, _DB_READERS
+    with _DB_STATE:
+        _DB_STATE.wait_for(lambda: not _DB_WRITING)
+        if _CONN is None:
+            _CONN = connect_db()
+        _DB_READERS += 1
+        return _CONN
+
+def end_read():
+    """Release a read registered by begin_read()"""
+    global _DB_READERS
+    with _DB_STATE:
+        _DB_READERS -= 1
+        _DB_STATE.notify_all()
+
+@contextmanager
+def read_db():
+    """Cursor on the shared read-only connection; writes wait until it is released"""
+    conn = begin_read()
+    try:
+        cursor = conn.cursor()
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+    finally:
+        end_read()
+
+@contextmanager
+def write_db():
+    """Read-write connection for one write; the shared read-only one is closed meanwhile"""
+    global _CONN, _DB_WRITING
+    with _WRITE_LOCK:
+        with _DB_STATE:
+            _DB_WRITING = True
+            if not _DB_STATE.wait_for(lambda: _DB_READERS == 0, timeout=DB_WRITE_WAIT):
+                _DB_WRITING = False
+                _DB_STATE.notify_all()
+                raise HTTPException(503, "Database busy, retry the write")
+        try:
+            if _CONN is not None:
+                _CONN.close()
+                _CONN = None
+            conn = connect_db(read_only=False)
+            try:
+                yield conn
+            finally:
+                conn.close()
+        finally:
+            with _DB_STATE:
+                _DB_WRITING = False
+                _DB_STATE.notify_all()
+
+def stream_json_rows(query, params, envelope=False):
+    """Run `query` and stream its rows as JSON, one Arrow record batch at a time"""
+    # The read stays open until the last batch is sent (or the client goes away)
+    with read_db() as conn:
+        reader = conn.execute(query, params).fetch_record_batch(STREAM_BATCH_SIZE)
+        dumps = orjson.dumps  # bound once: called for every row below
+        yield b'{"data":[' if envelope else b"["
+        count = 0
+        for batch in reader:
+            if batch.num_rows == 0:
+                continue
+            # Arrow builds the row dicts column-wise in C++ instead of dict(zip(...)) per row
+            chunk = b",".join(dumps(row, default=str) for row in batch.to_pylist())
+            yield (b"," if count else b"") + chunk
+            count += batch.num_rows
+        yield b'],"count":%d}' % count if envelope else b"]"
+
+def stream_query(query, params, envelope=False):
+    """StreamingResponse over `query`; the query runs (and can fail) before the response starts"""
+    rows = stream_json_rows(query, params, envelope)
+    first = next(rows)
+    return StreamingResponse(itertools.chain([first], rows), media_type="application/json")
 
 # Pydantic Models
 class EmployeeBase(BaseModel):
@@ -43,16 +198,14 @@ class EmployeeBase(BaseModel):
 class EmployeeCreate(EmployeeBase):
     pass
 
+class EmployeeBulkCreate(BaseModel):
+    employees: List[EmployeeCreate]
+
 class EmployeeUpdate(BaseModel):
     first_name: Optional[str] = None
     last_name: Optional[str] = None
     department_name: Optional[str] = None
 
-class TimesheetQuery(BaseModel):
-    client_employee_id: Optional[str] = None
-    start_date: Optional[str] = None
-    end_date: Optional[str] = None
-
 # AUTH - WORKING LOGIN
 @app.post("/auth/login")
 def login(request: LoginRequest):
@@ -60,7 +213,7 @@ def login(request: LoginRequest):
     if request.username == "leapfrog" and request.password == "leapfrog":
         payload = {
             "sub": request.username,
-            "exp": datetime.utcnow() + timedelta(hours=24)
+            "exp": int(time.time()) + TOKEN_TTL_SECONDS
         }
         token = jwt.encode(payload, JWT_SECRET, algorithm="HS256") 
         return {"access_token": token, "token_type": "bearer"}
@@ -74,52 +227,74 @@ def login(request: LoginRequest):
 def health():
     """Health check (public)"""
     try:
-        conn = get_db()
-        conn.execute("SELECT 1").fetchone()
-        conn.close()
-        return {"status": "healthy", "database": DB_PATH}
+        with read_db() as conn:
+            conn.execute("SELECT 1").fetchone()
+        return {"status": "healthy", "database": DB_PATH, "timestamp": int(time.time())}
     except Exception as e:
         raise HTTPException(500, f"DB error: {str(e)}")
 
 # EMPLOYEE CRUD - PROTECTED
 @app.post("/employees/", status_code=201)
 def create_employee(employee: EmployeeCreate, token=Depends(verify_token)):
-    conn = get_db()
-    try:
-        conn.execute("""
-            INSERT INTO silver_employees 
-            (client_employee_id, first_name, last_name, department_name, date_joined)
-            VALUES (?, ?, ?, ?, ?)
-        """, (employee.client_employee_id, employee.first_name, employee.last_name, employee.department_name, employee.date_joined))
-        conn.commit()
-        return {"message": "Employee created"}
-    except Exception as e:
-        raise HTTPException(400, f"Error: {str(e)}")
-    finally:
-        conn.close()
+    with write_db() as conn:
+        try:
+            conn.execute("""
+                INSERT INTO silver_employees 
+                (client_employee_id, first_name, last_name, department_name, date_joined)
+                VALUES (?, ?, ?, ?, ?)
+            """, (employee.client_employee_id, employee.first_name, employee.last_name, employee.department_name, employee.date_joined))
+            conn.commit()
+            return {"message": "Employee created"}
+        except Exception as e:
+            raise HTTPException(400, f"Error: {str(e)}")
+
+@app.post("/employees/bulk", status_code=201)
+def create_employees_bulk(bulk: EmployeeBulkCreate, token=Depends(verify_token)):
+    """Create or update many employees with one multi-row upsert per BATCH_SIZE rows"""
+    # One row per id (last one wins): DuckDB rejects an INSERT that hits the same key twice
+    rows = list({e.client_employee_id: (e.client_employee_id, e.first_name, e.last_name,
+                                        e.department_name, e.date_joined)
+                 for e in bulk.employees}.values())
+    if not rows:
+        raise HTTPException(400, "No employees to create")
+    
+    with write_db() as conn:
+        try:
+            conn.begin()
+            for start in range(0, len(rows), BATCH_SIZE):
+                batch = rows[start:start + BATCH_SIZE]
+                values = ", ".join(["(?, ?, ?, ?, ?)"] * len(batch))
+                conn.execute(f"""
+                    INSERT INTO silver_employees 
+                    (client_employee_id, first_name, last_name, department_name, date_joined)
+                    VALUES {values}
+                    ON CONFLICT (client_employee_id) DO UPDATE SET
+                        first_name = EXCLUDED.first_name,
+                        last_name = EXCLUDED.last_name,
+                        department_name = EXCLUDED.department_name,
+                        date_joined = EXCLUDED.date_joined
+                """, [value for row in batch for value in row])
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise HTTPException(400, f"Error: {str(e)}")
+    return {"message": f"{len(rows)} employees created or updated"}
 
 @app.get("/employees/")
-def get_employees(limit: int = 100, token=Depends(verify_token)):
-    conn = get_db()
-    result = conn.execute(f"SELECT * FROM silver_employees LIMIT {limit}").fetchall()
-    columns = [desc[0] for desc in conn.description]
-    data = [dict(zip(columns, row)) for row in result]
-    conn.close()
-    return data
+def get_employees(limit: int = Query(100, ge=1, le=10000), token=Depends(verify_token)):
+    return stream_query("SELECT * FROM silver_employees LIMIT ?", (limit,))
 
 @app.get("/employees/{emp_id}")
 def get_employee(emp_id: str, token=Depends(verify_token)):
-    conn = get_db()
-    result = conn.execute("SELECT * FROM silver_employees WHERE client_employee_id = ?", (emp_id,)).fetchone()
-    columns = [desc[0] for desc in conn.description]
-    conn.close()
+    with read_db() as conn:
+        result = conn.execute("SELECT * FROM silver_employees WHERE client_employee_id = ?", (emp_id,)).fetchone()
+        columns = [desc[0] for desc in conn.description]
     if result:
         return dict(zip(columns, result))
     raise HTTPException(404, "Employee not found")
 
 @app.put("/employees/{emp_id}")
 def update_employee(emp_id: str, employee: EmployeeUpdate, token=Depends(verify_token)):
-    conn = get_db()
     updates = []
     params = []
     if employee.first_name is not None:
@@ -134,9 +309,9 @@ def update_employee(emp_id: str, employee: EmployeeUpdate, token=Depends(verify_
     
     params.append(emp_id)
     query = f"UPDATE silver_employees SET {', '.join(updates)} WHERE client_employee_id = ?"
-    result = conn.execute(query, params).rowcount
-    conn.commit()
-    conn.close()
+    with write_db() as conn:
+        result = conn.execute(query, params).rowcount
+        conn.commit()
     
     if result == 0:
         raise HTTPException(404, "Not found")
@@ -144,10 +319,9 @@ def update_employee(emp_id: str, employee: EmployeeUpdate, token=Depends(verify_
 
 @app.delete("/employees/{emp_id}")
 def delete_employee(emp_id: str, token=Depends(verify_token)):
-    conn = get_db()
-    result = conn.execute("DELETE FROM silver_employees WHERE client_employee_id = ?", (emp_id,)).rowcount
-    conn.commit()
-    conn.close()
+    with write_db() as conn:
+        result = conn.execute("DELETE FROM silver_employees WHERE client_employee_id = ?", (emp_id,)).rowcount
+        conn.commit()
     if result == 0:
         raise HTTPException(404, "Not found")
     return {"message": "Deleted"}
@@ -155,8 +329,8 @@ def delete_employee(emp_id: str, token=Depends(verify_token)):
 # TIMESHEETS - PROTECTED
 @app.get("/timesheets/")
 def get_timesheets(client_employee_id: Optional[str] = None, start_date: Optional[str] = None, 
-                  end_date: Optional[str] = None, limit: int = 100, token=Depends(verify_token)):
-    conn = get_db()
+                  end_date: Optional[str] = None, limit: int = Query(100, ge=1, le=10000),
+                  token=Depends(verify_token)):
     query = "SELECT * FROM silver_timesheets"
     params = []
     conditions = []
@@ -170,125 +344,204 @@ def get_timesheets(client_employee_id: Optional[str] = None, start_date: Optiona
     
     if conditions:
         query += " WHERE " + " AND ".join(conditions)
-    query += f" ORDER BY punch_apply_date DESC LIMIT {limit}"
+    query += " ORDER BY punch_apply_date DESC LIMIT ?"
+    params.append(limit)
     
-    result = conn.execute(query, params).fetchall()
-    columns = [desc[0] for desc in conn.description]
-    data = [dict(zip(columns, row)) for row in result]
-    conn.close()
-    return {"data": data, "count": len(data)}
+    return stream_query(query, params, envelope=True)
 
 # KPIS - PROTECTED
-# [Keep all your imports and models exactly the same until KPIs]
+# Encoded KPI payloads keyed by handler name -> (etag, body, gzipped body)
+_KPI_CACHE = TTLCache(maxsize=64, ttl=KPI_CACHE_TTL)
+_KPI_CACHE_LOCK = threading.Lock()
+_KPI_LIMITER = None
+_KPI_HANDLERS = []
+
+def encode_kpi(handler, token=None):
+    """Run a KPI handler and encode its payload once: ETag, JSON body and gzip body"""
+    body = orjson.dumps(handler(token=token), default=str)
+    etag = '"%s"' % hashlib.blake2b(body, digest_size=8).hexdigest()
+    return etag, body, gzip.compress(body, compresslevel=6)
+
+def accepts_gzip(accept_encoding):
+    """True if the Accept-Encoding header allows gzip (or *) with a non-zero q-value"""
+    allowed = {}
+    for entry in accept_encoding.lower().split(","):
+        coding, *params = [part.strip() for part in entry.split(";")]
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if coding:
+            allowed[coding] = q > 0
+    return allowed.get("gzip", allowed.get("*", False))
+
+def cached_kpi(handler):
+    """Serve a KPI handler's payload from cache, answering If-None-Match with 304"""
+    # Cache hits are answered on the event loop; only misses take a worker thread
+    async def endpoint(request: Request, token=Depends(verify_token)):
+        # KPI endpoints take no parameters, so stray query strings share one entry
+        key = handler.__name__
+        with _KPI_CACHE_LOCK:
+            entry = _KPI_CACHE.get(key)
+        if entry is None:
+            entry = await to_thread.run_sync(encode_kpi, handler, token, limiter=_KPI_LIMITER)
+            with _KPI_CACHE_LOCK:
+                _KPI_CACHE[key] = entry
+        etag, body, gzipped = entry
+        # The gzip body is a different representation, so it gets its own strong ETag
+        gz_etag = etag[:-1] + '-gz"'
+        use_gzip = accepts_gzip(request.headers.get("accept-encoding", ""))
+        headers = {"ETag": gz_etag if use_gzip else etag,
+                   "Cache-Control": f"private, max-age={KPI_CACHE_TTL}",
+                   "Vary": "Accept-Encoding"}
+        if_none_match = [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]
+        if etag in if_none_match or gz_etag in if_none_match:
+            return Response(status_code=304, headers=headers)
+        if use_gzip:
+            headers["Content-Encoding"] = "gzip"
+            body = gzipped
+        return Response(content=body, media_type="application/json", headers=headers)
+    endpoint.__name__ = handler.__name__
+    endpoint.__doc__ = handler.__doc__
+    _KPI_HANDLERS.append(handler)
+    return endpoint
+
+@app.post("/admin/flush-kpi-cache")
+def flush_kpi_cache(request: Request, token=Depends(verify_token)):
+    """Drop cached KPI payloads so the next requests re-read the KPI tables (localhost only)"""
+    if request.client is None or request.client.host not in ("127.0.0.1", "::1"):
+        raise HTTPException(403, "KPI cache can only be flushed from localhost")
+    with _KPI_CACHE_LOCK:
+        _KPI_CACHE.clear()
+    return {"message": "KPI cache flushed"}
 
 # KPIS - ALL 9 PROTECTED ENDPOINTS (Fixed)
+# Read queries behind the KPI endpoints, aliased to the response keys. Each worker
+# thread keeps its own cursor with these PREPAREd on first use, so requests skip
+# parsing and planning.
+KPI_QUERIES = {
+    "active_headcount": """
+    SELECT month, active_headcount
+    FROM kpi_active_headcount
+    ORDER BY month DESC LIMIT 12
+    """,
+    "turnover": """
+    SELECT month, terminations, turnover_rate
+    FROM kpi_turnover_trend
+    ORDER BY month DESC LIMIT 12
+    """,
+    "tenure": """
+    SELECT department_name AS department, ROUND(avg_tenure_years, 2) AS avg_years, employee_count AS "count"
+    FROM kpi_avg_tenure
+    ORDER BY avg_tenure_years DESC
+    """,
+    "late_arrivals": """
+    SELECT client_employee_id AS employee_id, late_count, ROUND(avg_minutes_late, 1) AS avg_min_late
+    FROM kpi_late_arrivals
+    ORDER BY late_count DESC LIMIT 20
+    """,
+    "overtime": """
+    SELECT client_employee_id AS employee_id, overtime_days, ROUND(total_extra_hours, 1) AS extra_hours
+    FROM kpi_overtime
+    ORDER BY overtime_days DESC LIMIT 20
+    """,
+    "attrition": """
+    SELECT attrition_type AS "type", "count"
+    FROM kpi_early_attrition
+    ORDER BY "count" DESC
+    """,
+    "avg_working_hours": """
+    SELECT client_employee_id AS employee, week, ROUND(avg_hours, 1) AS avg_hours, days_worked AS days
+    FROM kpi_avg_working_hours
+    ORDER BY week DESC LIMIT 20
+    """,
+    "early_departures": """
+    SELECT client_employee_id AS employee_id, early_count, ROUND(avg_minutes_early, 1) AS avg_min_early
+    FROM kpi_early_departures
+    ORDER BY early_count DESC LIMIT 20
+    """,
+    "rolling_avg_hours": """
+    SELECT client_employee_id AS employee, punch_apply_date AS "date", ROUND(rolling_30day_avg, 1) AS rolling_30d_avg
+    FROM kpi_rolling_avg
+    ORDER BY punch_apply_date DESC LIMIT 50
+    """,
+}
+_kpi_local = threading.local()
+
+def execute_kpi(name):
+    """Run a prepared KPI query on this thread's cursor and return its rows as dicts"""
+    local = _kpi_local
+    conn = begin_read()
+    try:
+        # A write reopens the shared connection; statements prepared on the old one are gone
+        if getattr(local, "conn", None) is not conn:
+            local.conn, local.cursor, local.prepared = conn, conn.cursor(), set()
+        if name not in local.prepared:
+            local.cursor.execute(f"PREPARE {name} AS {KPI_QUERIES[name]}")
+            local.prepared.add(name)
+        return local.cursor.execute(f"EXECUTE {name}").fetch_arrow_table().to_pylist()
+    finally:
+        end_read()
+
 @app.get("/kpis/active-headcount")
+@cached_kpi
 def get_active_headcount(token=Depends(verify_token)):
-    conn = get_db()
-    result = conn.execute("""
-        SELECT month, active_headcount 
-        FROM kpi_active_headcount 
-        ORDER BY month DESC LIMIT 12
-    """).fetchall()
-    data = [{"month": r[0], "active_headcount": r[1]} for r in result]
-    conn.close()
-    return {"data": data}
+    return {"data": execute_kpi("active_headcount")}
 
 @app.get("/kpis/turnover")
+@cached_kpi
 def get_turnover(token=Depends(verify_token)):
-    conn = get_db()
-    result = conn.execute("""
-        SELECT month, terminations, turnover_rate 
-        FROM kpi_turnover_trend 
-        ORDER BY month DESC LIMIT 12
-    """).fetchall()
-    data = [{"month": r[0], "terminations": r[1], "turnover_rate": r[2]} for r in result]
-    conn.close()
-    return {"data": data}
+    return {"data": execute_kpi("turnover")}
 
 @app.get("/kpis/tenure")
+@cached_kpi
 def get_tenure(token=Depends(verify_token)):
-    conn = get_db()
-    result = conn.execute("""
-        SELECT department_name, ROUND(avg_tenure_years, 2) as avg_tenure_years, employee_count
-        FROM kpi_avg_tenure 
-        ORDER BY avg_tenure_years DESC
-    """).fetchall()
-    data = [{"department": r[0], "avg_years": r[1], "count": r[2]} for r in result]
-    conn.close()
-    return {"data": data}
+    return {"data": execute_kpi("tenure")}
 
 @app.get("/kpis/late-arrivals")
+@cached_kpi
 def get_late_arrivals(token=Depends(verify_token)):
-    conn = get_db()
-    result = conn.execute("""
-        SELECT client_employee_id, late_count, ROUND(avg_minutes_late, 1) as avg_minutes_late
-        FROM kpi_late_arrivals 
-        ORDER BY late_count DESC LIMIT 20
-    """).fetchall()
-    data = [{"employee_id": r[0], "late_count": r[1], "avg_min_late": r[2]} for r in result]
-    conn.close()
-    return {"data": data}
+    return {"data": execute_kpi("late_arrivals")}
 
 @app.get("/kpis/overtime")
+@cached_kpi
 def get_overtime(token=Depends(verify_token)):
-    conn = get_db()
-    result = conn.execute("""
-        SELECT client_employee_id, overtime_days, ROUND(total_extra_hours, 1) as total_extra_hours
-        FROM kpi_overtime 
-        ORDER BY overtime_days DESC LIMIT 20
-    """).fetchall()
-    data = [{"employee_id": r[0], "overtime_days": r[1], "extra_hours": r[2]} for r in result]
-    conn.close()
-    return {"data": data}
+    return {"data": execute_kpi("overtime")}
 
 @app.get("/kpis/attrition")
+@cached_kpi
 def get_attrition(token=Depends(verify_token)):
-    conn = get_db()
-    result = conn.execute("""
-        SELECT attrition_type, count 
-        FROM kpi_early_attrition 
-        ORDER BY count DESC
-    """).fetchall()
-    data = [{"type": r[0], "count": r[1]} for r in result]
-    conn.close()
-    return {"data": data}
+    return {"data": execute_kpi("attrition")}
 
 @app.get("/kpis/avg-working-hours")
+@cached_kpi
 def get_avg_working_hours(token=Depends(verify_token)):
-    conn = get_db()
-    result = conn.execute("""
-        SELECT client_employee_id, week, ROUND(avghours, 1), daysworked
-        FROM kpi_avg_working_hours 
-        ORDER BY week DESC LIMIT 20
-    """).fetchall()
-    data = [{"employee": r[0], "week": r[1], "avg_hours": r[2], "days": r[3]} for r in result]
-    conn.close()
-    return {"data": data}
+    return {"data": execute_kpi("avg_working_hours")}
 
 @app.get("/kpis/early-departures")
+@cached_kpi
 def get_early_departures(token=Depends(verify_token)):
-    conn = get_db()
-    result = conn.execute("""
-        SELECT client_employee_id, early_count, ROUND(avg_minutes_early, 1)
-        FROM kpi_early_departures 
-        ORDER BY early_count DESC LIMIT 20
-    """).fetchall()
-    data = [{"employee_id": r[0], "early_count": r[1], "avg_min_early": r[2]} for r in result]
-    conn.close()
-    return {"data": data}
+    return {"data": execute_kpi("early_departures")}
 
 @app.get("/kpis/rolling-avg-hours")
+@cached_kpi
 def get_rolling_avg_hours(token=Depends(verify_token)):
-    conn = get_db()
-    result = conn.execute("""
-        SELECT client_employee_id, punch_apply_date, ROUND(rolling30dayavg, 1)
-        FROM kpi_rolling_avg 
-        ORDER BY punch_apply_date DESC LIMIT 50
-    """).fetchall()
-    data = [{"employee": r[0], "date": r[1], "rolling_30d_avg": r[2]} for r in result]
-    conn.close()
-    return {"data": data}
+    return {"data": execute_kpi("rolling_avg_hours")}
+
+@app.on_event("startup")
+def warm_kpi_cache():
+    """Precompute every KPI payload so the first requests are cache hits"""
+    for handler in _KPI_HANDLERS:
+        try:
+            entry = encode_kpi(handler)
+        except duckdb.Error as e:
+            logger.warning(f"Could not precompute {handler.__name__} ({e})")
+            continue
+        with _KPI_CACHE_LOCK:
+            _KPI_CACHE[handler.__name__] = entry
 
 
 # Run server
@@ -13,10 +13,16 @@ class Config:
     
     # Database (DuckDB)
     DB_PATH = os.getenv("DB_PATH", "data/etl.db")
+    DB_THREADS = int(os.getenv("DB_THREADS", os.cpu_count() or 1))
+    DB_MEMORY_LIMIT = os.getenv("DB_MEMORY_LIMIT")  # e.g. "4GB"; DuckDB's default when unset
     
     # ETL
     LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
     BATCH_SIZE = int(os.getenv("BATCH_SIZE", 1000))
+    KPI_WORKERS = int(os.getenv("KPI_WORKERS", 4))
+    
+    # Reports
+    REPORT_GZIP_LEVEL = int(os.getenv("REPORT_GZIP_LEVEL", 0))  # 1-9 writes .html.gz; 0 keeps plain .html
     
     # API
     API_HOST = os.getenv("API_HOST", "0.0.0.0")
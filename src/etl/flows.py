@@ -1,7 +1,8 @@
+import hashlib
 import logging
 from pathlib import Path
-import pandas as pd
 import duckdb
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 logging.basicConfig(level=logging.INFO)
@@ -9,145 +10,197 @@ logger = logging.getLogger(__name__)
 
 from src.etl.config import config
 
+EMPLOYEE_DATE_COLUMNS = ['hire_date', 'term_date', 'dob']
+TIMESHEET_DATE_COLUMNS = ['punch_apply_date', 'punch_in_datetime', 'punch_out_datetime',
+                          'scheduled_start_datetime', 'scheduled_end_datetime']
+# Lookup indexes the API relies on; dropped before the bulk load and rebuilt after it
+SILVER_INDEXES = {
+    "ix_silver_employees_cid": "CREATE UNIQUE INDEX ix_silver_employees_cid ON silver_employees(client_employee_id)",
+    "ix_silver_timesheets_cid": "CREATE INDEX ix_silver_timesheets_cid ON silver_timesheets(client_employee_id)",
+}
+# Pinned so every file in a glob reads with the same types (no per-file sniffing/promotion)
+EMPLOYEE_COLUMN_TYPES = {'client_employee_id': 'VARCHAR', 'manager_employee_id': 'VARCHAR'}
+TIMESHEET_COLUMN_TYPES = {'client_employee_id': 'VARCHAR', 'pay_code': 'VARCHAR', 'hours_worked': 'DOUBLE'}
+
+def read_csv_sql(path, column_types):
+    """DuckDB read_csv_auto() over a pipe-delimited CSV file or glob, with `column_types` pinned"""
+    types = ", ".join(f"'{col}': '{col_type}'" for col, col_type in column_types.items())
+    return (f"read_csv_auto('{path}', delim='|', quote='\"', header=true, types={{{types}}}, "
+            f"normalize_names=true, union_by_name=true, parallel=true)")
+
+def source_fingerprint(files, reader):
+    """BLAKE2b over the reader SQL and each file's name, size and mtime; changes whenever either does"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(reader.encode())
+    for path in files:
+        stat = path.stat()
+        digest.update(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+def cleaned_columns(conn, table, date_columns):
+    """SELECT list for `table` with VARCHARs trimmed and `date_columns` cast to TIMESTAMP"""
+    exprs = []
+    for name, col_type, *_ in conn.execute(f"DESCRIBE {table}").fetchall():
+        expr = f'"{name}"'
+        if col_type == 'VARCHAR':
+            expr = f"TRIM({expr})"
+        if name in date_columns:
+            expr = f"TRY_CAST({expr} AS TIMESTAMP)"
+        exprs.append(f'{expr} AS "{name}"')
+    return ",\n".join(exprs)
+
 class ETLPipeline:
     def __init__(self):
-        self.conn = duckdb.connect(config.DB_PATH)
+        db_config = {"threads": config.DB_THREADS}
+        if config.DB_MEMORY_LIMIT:
+            db_config["memory_limit"] = config.DB_MEMORY_LIMIT
+        self.conn = duckdb.connect(config.DB_PATH, config=db_config)
         logger.info(f"Connected to DuckDB: {config.DB_PATH}")
     
-    def extract_employees(self):
-        """Extract employee CSV"""
-        logger.info("Extracting employees...")
-        emp_file = list(config.DATA_RAW_PATH.glob("employee*.csv"))[0]
-        df = pd.read_csv(emp_file, sep='|', quotechar='"')
-        df = df.map(lambda x: x.strip() if isinstance(x, str) else x)
-        logger.info(f"✓ Extracted {len(df)} employee records")
-        return df
+    def load_bronze_table(self, table_name, source, files, column_types):
+        """(Re)load one BRONZE table unless its source files are unchanged since the last run"""
+        reader = read_csv_sql(source, column_types)
+        fingerprint = source_fingerprint(files, reader)
+        cursor = self.conn.cursor()
+        try:
+            stored = cursor.execute("""
+                SELECT s.fingerprint FROM etl_source_state s
+                JOIN information_schema.tables t ON t.table_name = s.table_name
+                WHERE s.table_name = ?
+            """, [table_name]).fetchone()
+            if stored and stored[0] == fingerprint:
+                logger.info(f"✓ {table_name}: sources unchanged, keeping existing table")
+                return
+            
+            # CREATE TABLE AS reports the rows it wrote, so no follow-up COUNT(*) scan is needed
+            count = cursor.execute(
+                f"CREATE OR REPLACE TABLE {table_name} AS SELECT * FROM {reader}"
+            ).fetchone()[0]
+            cursor.execute("INSERT OR REPLACE INTO etl_source_state VALUES (?, ?)", [table_name, fingerprint])
+            logger.info(f"✓ Loaded {count} to {table_name} from {len(files)} files")
+        finally:
+            cursor.close()
     
-    def extract_timesheets(self):
-        """Extract & concatenate timesheet CSVs"""
-        logger.info("Extracting timesheets...")
+    def load_bronze(self):
+        """Load raw CSVs straight into the BRONZE layer (DuckDB read_csv_auto)"""
+        logger.info("Loading to BRONZE layer...")
+        emp_file = list(config.DATA_RAW_PATH.glob("employee*.csv"))[0]
         ts_files = sorted(config.DATA_RAW_PATH.glob("timesheet*.csv"))
         logger.info(f"Found {len(ts_files)} timesheet files: {[f.name for f in ts_files]}")
         
-        dfs = []
-        for ts_file in ts_files:
-            logger.info(f"Reading {ts_file.name}...")
-            df = pd.read_csv(ts_file, sep='|', quotechar='"', low_memory=False)
-            df = df.map(lambda x: x.strip() if isinstance(x, str) else x)
-            dfs.append(df)
-            logger.info(f"  ✓ {ts_file.name}: {len(df)} records")
-        
-        result = pd.concat(dfs, ignore_index=True)
-        logger.info(f"✓ Extracted {len(result)} timesheet records from {len(ts_files)} files")
-        return result
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS etl_source_state (
+                table_name VARCHAR PRIMARY KEY,
+                fingerprint VARCHAR
+            )
+        """)
+        # Independent tables: parse both sources at once, each on its own cursor
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            loads = [
+                pool.submit(self.load_bronze_table, "bronze_employees", emp_file, [emp_file], EMPLOYEE_COLUMN_TYPES),
+                pool.submit(self.load_bronze_table, "bronze_timesheets", config.DATA_RAW_PATH / "timesheet*.csv",
+                            ts_files, TIMESHEET_COLUMN_TYPES),
+            ]
+            for load in loads:
+                load.result()
     
-    def load_bronze(self, emp_df, ts_df):
-        """Load raw data to BRONZE layer (DuckDB)"""
-        logger.info("Loading to BRONZE layer...")
-        self.conn.execute("DROP TABLE IF EXISTS bronze_employees")
-        self.conn.execute("DROP TABLE IF EXISTS bronze_timesheets")
-        
-        self.conn.register("temp_emp", emp_df)
-        self.conn.execute("CREATE TABLE bronze_employees AS SELECT * FROM temp_emp")
-        self.conn.unregister("temp_emp")
-        logger.info(f"✓ Loaded {len(emp_df)} to bronze_employees")
-        
-        self.conn.register("temp_ts", ts_df)
-        self.conn.execute("CREATE TABLE bronze_timesheets AS SELECT * FROM temp_ts")
-        self.conn.unregister("temp_ts")
-        logger.info(f"✓ Loaded {len(ts_df)} to bronze_timesheets")
-    
-    def transform_employees(self, emp_df):
-        """Clean & validate employee data"""
+    def transform_employees(self):
+        """Clean & validate employee data (SQL over bronze_employees)"""
         logger.info("Transforming employees...")
-        
-        # Make a copy to avoid SettingWithCopyWarning
-        emp_df = emp_df.copy()
-        
-        # Remove duplicates
-        emp_df = emp_df.drop_duplicates(subset=['client_employee_id'], keep='first')
-        
-        # Fix date columns
-        for col in ['hire_date', 'term_date', 'dob']:
-            if col in emp_df.columns:
-                emp_df[col] = pd.to_datetime(emp_df[col], errors='coerce')
-        
-        # Add derived columns
-        emp_df['is_active'] = emp_df['term_date'].isna().astype(int)
-        emp_df['tenure_days'] = (emp_df['term_date'].fillna(pd.Timestamp.now().normalize()) - emp_df['hire_date']).dt.days
-        
-        logger.info(f"✓ Transformed {len(emp_df)} employees")
-        return emp_df
+        # Trim strings, type the date columns, drop duplicates (first row wins), add derived columns
+        return f"""
+            SELECT * EXCLUDE (source_row),
+                (term_date IS NULL)::INTEGER AS is_active,
+                DATE_DIFF('day', hire_date, COALESCE(term_date, current_date::TIMESTAMP))::INTEGER AS tenure_days
+            FROM (
+                SELECT rowid AS source_row,
+                    {cleaned_columns(self.conn, 'bronze_employees', EMPLOYEE_DATE_COLUMNS)}
+                FROM bronze_employees
+            )
+            QUALIFY ROW_NUMBER() OVER (PARTITION BY client_employee_id ORDER BY source_row) = 1
+        """
     
-    def transform_timesheets(self, ts_df):
-        """Clean & validate timesheet data"""
+    def transform_timesheets(self):
+        """Clean & validate timesheet data (one fused SQL pass over bronze_timesheets)"""
         logger.info("Transforming timesheets...")
-        
-        # Make a copy to avoid SettingWithCopyWarning
-        ts_df = ts_df.copy()
-        
-        # Remove duplicates
-        ts_df = ts_df.drop_duplicates(subset=['client_employee_id', 'punch_in_datetime'], keep='first')
-        
-        # Fix datetime columns
-        ts_df['punch_apply_date'] = pd.to_datetime(ts_df['punch_apply_date'], errors='coerce')
-        ts_df['punch_in_datetime'] = pd.to_datetime(ts_df['punch_in_datetime'], errors='coerce')
-        ts_df['punch_out_datetime'] = pd.to_datetime(ts_df['punch_out_datetime'], errors='coerce')
-        ts_df['scheduled_start_datetime'] = pd.to_datetime(ts_df['scheduled_start_datetime'], errors='coerce')
-        ts_df['scheduled_end_datetime'] = pd.to_datetime(ts_df['scheduled_end_datetime'], errors='coerce')
-        
-        # Calculate late/early arrivals (in minutes)
-        ts_df['minutes_late'] = ((ts_df['punch_in_datetime'] - ts_df['scheduled_start_datetime']).dt.total_seconds() / 60).fillna(0)
-        ts_df['minutes_early'] = ((ts_df['scheduled_end_datetime'] - ts_df['punch_out_datetime']).dt.total_seconds() / 60).fillna(0)
-        
-        # Mark anomalies (grace: ±5 min)
-        ts_df['is_late'] = (ts_df['minutes_late'] > 5).astype(int)
-        ts_df['is_early'] = (ts_df['minutes_early'] > 5).astype(int)
-        ts_df['is_overtime'] = (ts_df['hours_worked'] > 8.5).astype(int)
-        ts_df['is_normal_work'] = ((ts_df['hours_worked'] >= 7.5) & (ts_df['hours_worked'] <= 8.5)).astype(int)
-        
-        logger.info(f"✓ Transformed {len(ts_df)} timesheet records")
-        return ts_df
+        return f"""
+            SELECT * EXCLUDE (source_row),
+                -- Late/early arrivals (whole minutes)
+                COALESCE(FLOOR(EPOCH(punch_in_datetime - scheduled_start_datetime) / 60), 0)::INTEGER AS minutes_late,
+                COALESCE(FLOOR(EPOCH(scheduled_end_datetime - punch_out_datetime) / 60), 0)::INTEGER AS minutes_early,
+                -- Anomalies (grace: ±5 min)
+                (minutes_late > 5)::TINYINT AS is_late,
+                (minutes_early > 5)::TINYINT AS is_early,
+                COALESCE(hours_worked > 8.5, false)::TINYINT AS is_overtime,
+                COALESCE(hours_worked BETWEEN 7.5 AND 8.5, false)::TINYINT AS is_normal_work,
+                -- Reporting periods shared by the KPIs
+                DATE_TRUNC('month', punch_apply_date)::date AS punch_month,
+                DATE_TRUNC('week', punch_apply_date)::date AS punch_week
+            FROM (
+                SELECT rowid AS source_row,
+                    {cleaned_columns(self.conn, 'bronze_timesheets', TIMESHEET_DATE_COLUMNS)}
+                FROM bronze_timesheets
+            )
+            QUALIFY ROW_NUMBER() OVER (
+                PARTITION BY client_employee_id, punch_in_datetime
+                ORDER BY punch_apply_date DESC NULLS LAST, source_row
+            ) = 1
+        """
     
-    def load_silver(self, emp_df, ts_df):
+    def load_silver_table(self, table_name, query):
+        """Build one SILVER table and write its Parquet snapshot"""
+        cursor = self.conn.cursor()
+        try:
+            count = cursor.execute(f"CREATE OR REPLACE TABLE {table_name} AS {query}").fetchone()[0]
+            logger.info(f"✓ Loaded {count} to {table_name}")
+            
+            # Columnar snapshot (ZSTD + dictionary pages) for readers outside the DuckDB file
+            parquet_file = config.DATA_SILVER_PATH / f"{table_name}.parquet"
+            cursor.execute(f"COPY {table_name} TO '{parquet_file}' "
+                           f"(FORMAT PARQUET, COMPRESSION ZSTD, ROW_GROUP_SIZE 128000)")
+            logger.info(f"✓ Wrote {parquet_file}")
+        finally:
+            cursor.close()
+    
+    def load_silver(self, emp_query, ts_query):
         """Load cleaned data to SILVER layer (DuckDB)"""
         logger.info("Loading to SILVER layer...")
         
-        self.conn.register("temp_emp_silver", emp_df)
-        self.conn.execute("CREATE TABLE silver_employees AS SELECT * FROM temp_emp_silver")
-        self.conn.unregister("temp_emp_silver")
-        logger.info(f"✓ Loaded {len(emp_df)} to silver_employees")
+        config.DATA_SILVER_PATH.mkdir(parents=True, exist_ok=True)
+        
+        for index_name in SILVER_INDEXES:
+            self.conn.execute(f"DROP INDEX IF EXISTS {index_name}")
+        
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            loads = [
+                pool.submit(self.load_silver_table, "silver_employees", emp_query),
+                pool.submit(self.load_silver_table, "silver_timesheets", ts_query),
+            ]
+            for load in loads:
+                load.result()
         
-        self.conn.register("temp_ts_silver", ts_df)
-        self.conn.execute("CREATE TABLE silver_timesheets AS SELECT * FROM temp_ts_silver")
-        self.conn.unregister("temp_ts_silver")
-        logger.info(f"✓ Loaded {len(ts_df)} to silver_timesheets")
+        for statement in SILVER_INDEXES.values():
+            self.conn.execute(statement)
+        logger.info(f"✓ Built {len(SILVER_INDEXES)} silver indexes")
     
     def generate_kpis(self):
-        """Generate all 9 KPI tables in GOLD layer"""
+        """Generate all KPI tables in GOLD layer"""
         logger.info("Generating KPIs...")
         
+        # GOLD tables hold complete aggregates; top-N and ordering belong to the API/report queries
         kpis = [
             ("kpi_active_headcount", """
+                WITH punch_days AS (
+                    SELECT DISTINCT punch_apply_date, punch_month FROM silver_timesheets
+                )
                 SELECT 
-                    DATE_TRUNC('month', punch_apply_date)::date AS month,
-                    COUNT(DISTINCT CASE 
-                        WHEN e.hire_date <= ts.punch_apply_date 
-                        AND (e.term_date IS NULL OR e.term_date > ts.punch_apply_date)
-                        THEN e.client_employee_id 
-                    END) AS active_headcount
-                FROM silver_timesheets ts
-                CROSS JOIN (SELECT DISTINCT client_employee_id, hire_date, term_date FROM silver_employees) e
-                GROUP BY DATE_TRUNC('month', punch_apply_date)
-                ORDER BY month DESC
-            """),
-            ("kpi_turnover_trend", """
-                SELECT 
-                    DATE_TRUNC('month', term_date)::date AS month,
-                    COUNT(*) AS terminations
-                FROM silver_employees
-                WHERE term_date IS NOT NULL
-                GROUP BY DATE_TRUNC('month', term_date)
+                    d.punch_month AS month,
+                    COUNT(DISTINCT e.client_employee_id) AS active_headcount
+                FROM punch_days d
+                LEFT JOIN silver_employees e
+                    ON e.hire_date <= d.punch_apply_date
+                    AND COALESCE(e.term_date, 'infinity'::TIMESTAMP) > d.punch_apply_date
+                GROUP BY d.punch_month
                 ORDER BY month DESC
             """),
             ("kpi_avg_tenure", """
@@ -163,14 +216,12 @@ class ETLPipeline:
             ("kpi_avg_working_hours", """
                 SELECT 
                     client_employee_id,
-                    DATE_TRUNC('week', punch_apply_date)::date AS week,
+                    punch_week AS week,
                     ROUND(AVG(hours_worked), 2) AS avg_hours,
                     COUNT(*) AS days_worked
                 FROM silver_timesheets
                 WHERE is_normal_work = 1
-                GROUP BY client_employee_id, DATE_TRUNC('week', punch_apply_date)
-                ORDER BY week DESC
-                LIMIT 1000
+                GROUP BY client_employee_id, punch_week
             """),
             ("kpi_late_arrivals", """
                 SELECT 
@@ -180,8 +231,6 @@ class ETLPipeline:
                 FROM silver_timesheets
                 WHERE is_late = 1
                 GROUP BY client_employee_id
-                ORDER BY late_count DESC
-                LIMIT 100
             """),
             ("kpi_early_departures", """
                 SELECT 
@@ -191,8 +240,6 @@ class ETLPipeline:
                 FROM silver_timesheets
                 WHERE is_early = 1
                 GROUP BY client_employee_id
-                ORDER BY early_count DESC
-                LIMIT 100
             """),
             ("kpi_overtime", """
                 SELECT 
@@ -202,8 +249,6 @@ class ETLPipeline:
                 FROM silver_timesheets
                 WHERE is_overtime = 1
                 GROUP BY client_employee_id
-                ORDER BY overtime_days DESC
-                LIMIT 100
             """),
             ("kpi_rolling_avg", """
                 SELECT 
@@ -215,8 +260,6 @@ class ETLPipeline:
                         ROWS BETWEEN 29 PRECEDING AND CURRENT ROW
                     ), 2) AS rolling_30day_avg
                 FROM silver_timesheets
-                ORDER BY punch_apply_date DESC
-                LIMIT 5000
             """),
             ("kpi_early_attrition", """
                 SELECT 
@@ -235,14 +278,47 @@ class ETLPipeline:
             """),
         ]
         
-        for table_name, query in kpis:
+        # KPIs only read silver_*, so build them concurrently, one cursor per table
+        def build_kpi(kpi):
+            table_name, query = kpi
+            cursor = self.conn.cursor()
             try:
-                self.conn.execute(f"DROP TABLE IF EXISTS {table_name}")
-                self.conn.execute(f"CREATE TABLE {table_name} AS {query}")
-                count = self.conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchall()[0][0]
+                count = cursor.execute(f"CREATE OR REPLACE TABLE {table_name} AS {query}").fetchone()[0]
                 logger.info(f"✓ {table_name}: {count} rows")
             except Exception as e:
                 logger.warning(f"{table_name}: {str(e)}")
+            finally:
+                cursor.close()
+        
+        with ThreadPoolExecutor(max_workers=config.KPI_WORKERS) as pool:
+            list(pool.map(build_kpi, kpis))
+        
+        # Weekly roll-up of kpi_avg_working_hours, so it must wait for that table
+        build_kpi(("kpi_weekly_avg_hours", """
+            SELECT 
+                week,
+                ROUND(AVG(avg_hours), 2) AS avg_hours_all,
+                COUNT(DISTINCT client_employee_id) AS num_employees
+            FROM kpi_avg_working_hours
+            GROUP BY week
+        """))
+        
+        # Terminations per 100 active employees that month, so it must wait for kpi_active_headcount
+        build_kpi(("kpi_turnover_trend", """
+            SELECT 
+                t.month,
+                t.terminations,
+                ROUND(t.terminations * 100.0 / NULLIF(h.active_headcount, 0), 2) AS turnover_rate
+            FROM (
+                SELECT 
+                    DATE_TRUNC('month', term_date)::date AS month,
+                    COUNT(*) AS terminations
+                FROM silver_employees
+                WHERE term_date IS NOT NULL
+                GROUP BY DATE_TRUNC('month', term_date)
+            ) t
+            LEFT JOIN kpi_active_headcount h ON h.month = t.month
+        """))
     
     def validate_data_quality(self):
         """Run quality checks"""
@@ -258,16 +334,12 @@ class ETLPipeline:
         logger.info("Starting ETL Pipeline...")
         
         try:
-            # Extract
-            emp_df = self.extract_employees()
-            ts_df = self.extract_timesheets()
-            
-            # Load Bronze
-            self.load_bronze(emp_df, ts_df)
+            # Extract & Load Bronze
+            self.load_bronze()
             
             # Transform
-            emp_clean = self.transform_employees(emp_df)
-            ts_clean = self.transform_timesheets(ts_df)
+            emp_clean = self.transform_employees()
+            ts_clean = self.transform_timesheets()
             
             # Load Silver
             self.load_silver(emp_clean, ts_clean)
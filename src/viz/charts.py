@@ -1,119 +1,245 @@
 import duckdb
+import gzip
+import hashlib
 import plotly.express as px
 import plotly.graph_objects as go
+import plotly.io as pio
+import pyarrow.feather as feather
 import os
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
 from src.etl.config import config
 
-def generate_charts():
-    """Generate interactive Plotly charts for all 9 KPIs"""
-    conn = duckdb.connect(config.DB_PATH)
-    os.makedirs('reports', exist_ok=True)
-    
-    # Chart 1: Active Headcount Over Time
-    df1 = conn.execute("SELECT * FROM kpi_active_headcount ORDER BY month").df()
-    df1['month'] = pd.to_datetime(df1['month']).dt.strftime('%Y-%m')
-    fig1 = px.line(df1, x='month', y='active_headcount',
-                   title='Active Headcount Over Time',
-                   markers=True, template='plotly_dark')
-    fig1.write_html('reports/01_active_headcount.html')
-    print("✓ Generated: 01_active_headcount.html")
-    
-    # Chart 2: Turnover by Month
-    df2 = conn.execute("SELECT * FROM kpi_turnover_trend ORDER BY month").df()
-    df2['month'] = pd.to_datetime(df2['month']).dt.strftime('%Y-%m')
-    fig2 = px.bar(df2, x='month', y='terminations',
-                  title='Monthly Turnover Trend',
-                  template='plotly_dark')
-    fig2.write_html('reports/02_turnover_trend.html')
-    print("✓ Generated: 02_turnover_trend.html")
-    
-    # Chart 3: Tenure by Department
-    df3 = conn.execute("SELECT * FROM kpi_avg_tenure ORDER BY avg_tenure_years DESC").df()
-    fig3 = px.bar(df3, x='department_name', y='avg_tenure_years',
+CACHE_DIR = Path('reports/.cache')
+# Resolved once at import; every figure shares the same template object
+TEMPLATE = pio.templates['plotly_dark']
+# Serialize figure JSON with orjson (C) instead of the stdlib json encoder
+pio.json.config.default_engine = 'orjson'
+# Disk writes run here so the next figure can serialize while the last one is written
+WRITE_POOL = ThreadPoolExecutor(max_workers=4)
+
+# One query per chart, fetched together before any figure is built
+QUERIES = {
+    "active_headcount": """
+        SELECT strftime(month, '%Y-%m') AS month, active_headcount::INTEGER AS active_headcount
+        FROM kpi_active_headcount
+        ORDER BY month
+    """,
+    "turnover_trend": """
+        SELECT strftime(month, '%Y-%m') AS month, terminations::INTEGER AS terminations
+        FROM kpi_turnover_trend
+        ORDER BY month
+    """,
+    "tenure_by_dept": """
+        SELECT department_name, ROUND(avg_tenure_years, 2) AS avg_tenure_years, employee_count::INTEGER AS employee_count
+        FROM kpi_avg_tenure
+        ORDER BY avg_tenure_years DESC
+    """,
+    "late_arrivals": """
+        SELECT client_employee_id, late_count::INTEGER AS late_count
+        FROM kpi_late_arrivals
+        ORDER BY late_count DESC LIMIT 20
+    """,
+    "overtime": """
+        SELECT client_employee_id, ROUND(total_extra_hours, 2) AS total_extra_hours
+        FROM kpi_overtime
+        ORDER BY overtime_days DESC LIMIT 20
+    """,
+    "attrition_type": 'SELECT attrition_type, "count"::INTEGER AS "count" FROM kpi_early_attrition',
+    "avg_working_hours": """
+        SELECT strftime(week, '%Y-%m-%d') AS week, avg_hours_all, num_employees::INTEGER AS num_employees
+        FROM kpi_weekly_avg_hours
+        ORDER BY week DESC
+        LIMIT 50
+    """,
+    "early_departures": """
+        SELECT client_employee_id, early_count::INTEGER AS early_count
+        FROM kpi_early_departures
+        ORDER BY early_count DESC LIMIT 20
+    """,
+    "rolling_avg_hours": """
+        WITH sampled AS (
+            SELECT client_employee_id
+            FROM (SELECT DISTINCT client_employee_id FROM kpi_rolling_avg)
+            USING SAMPLE reservoir(10 ROWS) REPEATABLE (42)
+        )
+        SELECT r.client_employee_id, strftime(r.punch_apply_date, '%Y-%m-%d') AS punch_apply_date,
+               ROUND(r.rolling_30day_avg, 2) AS rolling_30day_avg
+        FROM kpi_rolling_avg r
+        JOIN sampled USING (client_employee_id)
+        ORDER BY punch_apply_date DESC
+    """,
+}
+
+def _fetch(cur, sql):
+    """Run `sql` and return the result as an Arrow table (no pandas/NumPy conversion)"""
+    return cur.execute(sql).fetch_arrow_table()
+
+def data_version():
+    """mtime of the DuckDB file and its WAL; changes whenever the database is written"""
+    paths = [config.DB_PATH, f"{config.DB_PATH}.wal"]
+    return ":".join(str(os.stat(path).st_mtime_ns) for path in paths if os.path.exists(path))
+
+def cache_path(sql, version):
+    """Feather file holding `sql`'s result for this data version"""
+    key = hashlib.sha256(f"{version}\n{sql}".encode()).hexdigest()
+    return CACHE_DIR / f"{key}.feather"
+
+def cached_fetch(cur, sql, version):
+    """_fetch() behind an on-disk Feather cache keyed by the SQL and the data version"""
+    path = cache_path(sql, version)
+    if path.exists():
+        return feather.read_table(path)
+    table = _fetch(cur, sql)
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    feather.write_feather(table, tmp_path, compression='zstd')
+    os.replace(tmp_path, path)
+    return table
+
+def fetch_all(conn):
+    """Run every chart query concurrently, one cursor each; returns {name: Arrow table}"""
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    version = data_version()
+    # Results for older data versions can never be hit again
+    current = {cache_path(sql, version) for sql in QUERIES.values()}
+    for stale in CACHE_DIR.glob("*.feather"):
+        if stale not in current:
+            stale.unlink(missing_ok=True)
+
+    def run(item):
+        name, sql = item
+        cur = conn.cursor()
+        try:
+            return name, cached_fetch(cur, sql, version)
+        finally:
+            cur.close()
+
+    with ThreadPoolExecutor(max_workers=min(len(QUERIES), os.cpu_count() or 1)) as pool:
+        return dict(pool.map(run, QUERIES.items()))
+
+def _write_file(filename, html):
+    """Write one report page (pre-gzipped when REPORT_GZIP_LEVEL is set); returns the file written"""
+    if config.REPORT_GZIP_LEVEL:
+        filename = f"{filename}.gz"
+        Path('reports', filename).write_bytes(gzip.compress(html.encode('utf-8'), config.REPORT_GZIP_LEVEL))
+    else:
+        Path('reports', filename).write_text(html, encoding='utf-8')
+    return filename
+
+def _write_report(fig, filename):
+    """Serialize `fig` as a standalone, responsive page (plotly.js from the CDN) and queue the write"""
+    html = fig.to_html(include_plotlyjs='cdn', full_html=True, config={'responsive': True})
+    return WRITE_POOL.submit(_write_file, filename, html)
+
+def _arrow_frame(table):
+    """Arrow table -> pandas for Plotly Express, keeping Arrow-backed columns (no object strings)"""
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+def _simple_figure(trace, table, x, y, title, **trace_kwargs):
+    """Single-trace figure built straight from Arrow columns, skipping Plotly Express"""
+    return go.Figure(
+        trace(x=table[x].to_numpy(), y=table[y].to_numpy(), **trace_kwargs),
+        layout=go.Layout(title=title, template=TEMPLATE, xaxis_title=x, yaxis_title=y),
+    )
+
+def _chart_1(df1):
+    """Chart 1: Active Headcount Over Time"""
+    fig1 = _simple_figure(go.Scatter, df1, 'month', 'active_headcount',
+                          'Active Headcount Over Time', mode='lines+markers')
+    return _write_report(fig1, '01_active_headcount.html')
+
+def _chart_2(df2):
+    """Chart 2: Turnover by Month"""
+    fig2 = _simple_figure(go.Bar, df2, 'month', 'terminations', 'Monthly Turnover Trend')
+    return _write_report(fig2, '02_turnover_trend.html')
+
+def _chart_3(df3):
+    """Chart 3: Tenure by Department"""
+    fig3 = px.bar(_arrow_frame(df3), x='department_name', y='avg_tenure_years',
                   color='employee_count',
                   title='Average Tenure by Department',
-                  template='plotly_dark')
-    fig3.write_html('reports/03_tenure_by_dept.html')
-    print("✓ Generated: 03_tenure_by_dept.html")
-    
-    # Chart 4: Late Arrivals Distribution
-    df4 = conn.execute("SELECT * FROM kpi_late_arrivals ORDER BY late_count DESC LIMIT 20").df()
-    fig4 = px.bar(df4, x='client_employee_id', y='late_count',
-                  title='Top 20 Employees with Late Arrivals',
-                  template='plotly_dark')
-    fig4.write_html('reports/04_late_arrivals.html')
-    print("✓ Generated: 04_late_arrivals.html")
-    
-    # Chart 5: Overtime Distribution
-    df5 = conn.execute("SELECT * FROM kpi_overtime ORDER BY overtime_days DESC LIMIT 20").df()
-    fig5 = px.bar(df5, x='client_employee_id', y='total_extra_hours',
-                  title='Top 20 Employees with Overtime Hours',
-                  template='plotly_dark')
-    fig5.write_html('reports/05_overtime.html')
-    print("✓ Generated: 05_overtime.html")
-    
-    # Chart 6: Attrition Type Distribution (Got FULL PIE BECAUSE 6 and 0 is the data that i got)
-    df6 = conn.execute("SELECT * FROM kpi_early_attrition").df()
+                  template=TEMPLATE)
+    return _write_report(fig3, '03_tenure_by_dept.html')
+
+def _chart_4(df4):
+    """Chart 4: Late Arrivals Distribution"""
+    fig4 = _simple_figure(go.Bar, df4, 'client_employee_id', 'late_count',
+                          'Top 20 Employees with Late Arrivals')
+    return _write_report(fig4, '04_late_arrivals.html')
+
+def _chart_5(df5):
+    """Chart 5: Overtime Distribution"""
+    fig5 = _simple_figure(go.Bar, df5, 'client_employee_id', 'total_extra_hours',
+                          'Top 20 Employees with Overtime Hours')
+    return _write_report(fig5, '05_overtime.html')
+
+def _chart_6(df6):
+    """Chart 6: Attrition Type Distribution (Got FULL PIE BECAUSE 6 and 0 is the data that i got)"""
     if len(df6) > 0:
-        fig6 = px.pie(df6, names='attrition_type', values='count',
+        fig6 = px.pie(_arrow_frame(df6), names='attrition_type', values='count',
                       title='Attrition Type Distribution',
-                      template='plotly_dark')
-        fig6.write_html('reports/06_attrition_type.html')
-        print("✓ Generated: 06_attrition_type.html")
-    
-    # Chart 7: Average Working Hours by Week - FIXED: Aggregate by week
-    df7 = conn.execute("""
-        SELECT week, ROUND(AVG(avg_hours), 2) as avg_hours_all, COUNT(DISTINCT client_employee_id) as num_employees
-        FROM kpi_avg_working_hours
-        GROUP BY week
-        ORDER BY week DESC
-        LIMIT 50
-    """).df()
+                      template=TEMPLATE)
+        return _write_report(fig6, '06_attrition_type.html')
+
+def _chart_7(df7):
+    """Chart 7: Average Working Hours by Week - FIXED: Aggregate by week"""
     if len(df7) > 0:
-        df7['week'] = pd.to_datetime(df7['week']).dt.strftime('%Y-%m-%d')
-        fig7 = px.line(df7, x='week', y='avg_hours_all',
+        fig7 = px.line(_arrow_frame(df7), x='week', y='avg_hours_all',
                        title='Average Working Hours by Week (All Employees)',
-                       markers=True, template='plotly_dark',
+                       markers=True, template=TEMPLATE,
                        hover_data=['num_employees'],
                        labels={'avg_hours_all': 'Avg Hours', 'num_employees': 'Employees'})
-        fig7.write_html('reports/07_avg_working_hours.html')
-        print("✓ Generated: 07_avg_working_hours.html")
-    
-    # Chart 8: Early Departures Distribution
-    df8 = conn.execute("SELECT * FROM kpi_early_departures ORDER BY early_count DESC LIMIT 20").df()
+        return _write_report(fig7, '07_avg_working_hours.html')
+
+def _chart_8(df8):
+    """Chart 8: Early Departures Distribution"""
     if len(df8) > 0:
-        fig8 = px.bar(df8, x='client_employee_id', y='early_count',
-                      title='Top 20 Employees with Early Departures (>5min)',
-                      template='plotly_dark')
-        fig8.write_html('reports/08_early_departures.html')
-        print("✓ Generated: 08_early_departures.html")
-    
-    # Chart 9: Rolling 30-Day Average Hours - FIXED: (Sample 10 random employees)
-    df9_all = conn.execute("SELECT DISTINCT client_employee_id FROM kpi_rolling_avg ORDER BY RANDOM() LIMIT 10").df()
-    
-    if len(df9_all) > 0:
-        employees = df9_all['client_employee_id'].tolist()
-        placeholders = ','.join(['?' for _ in employees])
-        df9 = conn.execute(f"""
-            SELECT client_employee_id, punch_apply_date, rolling_30day_avg
-            FROM kpi_rolling_avg
-            WHERE client_employee_id IN ({placeholders})
-            ORDER BY punch_apply_date DESC
-        """, employees).df()
-        
-        if len(df9) > 0:
-            df9['punch_apply_date'] = pd.to_datetime(df9['punch_apply_date']).dt.strftime('%Y-%m-%d')
-            fig9 = px.line(df9, x='punch_apply_date', y='rolling_30day_avg',
-                           color='client_employee_id',
-                           title='Rolling 30-Day Average Hours (10 Sample Employees)',
-                           template='plotly_dark',
-                           labels={'punch_apply_date': 'Date', 'rolling_30day_avg': 'Rolling Avg (30d)'})
-            fig9.write_html('reports/09_rolling_avg_hours.html')
-            print("✓ Generated: 09_rolling_avg_hours.html")
-    
-    conn.close()
-    print("\nAll 9 visualizations generated in reports/ folder!")
+        fig8 = _simple_figure(go.Bar, df8, 'client_employee_id', 'early_count',
+                              'Top 20 Employees with Early Departures (>5min)')
+        return _write_report(fig8, '08_early_departures.html')
+
+def _chart_9(df9):
+    """Chart 9: Rolling 30-Day Average Hours - FIXED: (Sample 10 random employees)"""
+    if len(df9) > 0:
+        fig9 = px.line(_arrow_frame(df9), x='punch_apply_date', y='rolling_30day_avg',
+                       color='client_employee_id',
+                       title='Rolling 30-Day Average Hours (10 Sample Employees)',
+                       template=TEMPLATE,
+                       labels={'punch_apply_date': 'Date', 'rolling_30day_avg': 'Rolling Avg (30d)'})
+        return _write_report(fig9, '09_rolling_avg_hours.html')
+
+CHARTS = {
+    "active_headcount": _chart_1,
+    "turnover_trend": _chart_2,
+    "tenure_by_dept": _chart_3,
+    "late_arrivals": _chart_4,
+    "overtime": _chart_5,
+    "attrition_type": _chart_6,
+    "avg_working_hours": _chart_7,
+    "early_departures": _chart_8,
+    "rolling_avg_hours": _chart_9,
+}
+
+def generate_charts():
+    """Generate interactive Plotly charts for all 9 KPIs"""
+    db_config = {"threads": config.DB_THREADS}
+    if config.DB_MEMORY_LIMIT:
+        db_config["memory_limit"] = config.DB_MEMORY_LIMIT
+    conn = duckdb.connect(config.DB_PATH, read_only=True, config=db_config)
+    os.makedirs('reports', exist_ok=True)
+    try:
+        data = fetch_all(conn)
+    finally:
+        conn.close()
+
+    # Charts are independent: build them concurrently; each returns its pending write (None if no data)
+    with ThreadPoolExecutor(max_workers=min(len(CHARTS), os.cpu_count() or 1)) as pool:
+        futures = [pool.submit(chart, data[name]) for name, chart in CHARTS.items()]
+        writes = [future.result() for future in as_completed(futures)]
+    generated = sorted(write.result() for write in writes if write is not None)
+    print("\n".join(f"✓ Generated: {filename}" for filename in generated)
+          + f"\n\nAll {len(generated)} visualizations generated in reports/ folder!")
 
 if __name__ == "__main__":
-    generate_charts()
\ No newline at end of file
+    generate_charts()
@@ -0,0 +1,121 @@
+import asyncio
+import gzip
+
+import duckdb
+import pytest
+from starlette.requests import Request
+
+from src.api import main
+
+
+def make_request(**headers):
+    """Bare GET request carrying `headers` (underscores become dashes)"""
+    raw = [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()]
+    return Request({"type": "http", "method": "GET", "path": "/kpis/test",
+                    "query_string": b"", "headers": raw})
+
+@pytest.mark.parametrize("header, expected", [
+    ("gzip", True),
+    ("deflate, gzip;q=0.5", True),
+    ("GZIP", True),
+    ("gzip;q=0", False),
+    ("gzip; q=0.0, deflate", False),
+    ("*", True),
+    ("*;q=0", False),
+    ("deflate, *", True),
+    ("gzip;q=0, *", False),
+    ("gzip;q=abc", False),
+    ("deflate", False),
+    ("", False),
+])
+def test_accepts_gzip(header, expected):
+    assert main.accepts_gzip(header) is expected
+
+@pytest.fixture
+def kpi_endpoint():
+    """cached_kpi around a DB-free handler, with a clean cache"""
+    def get_test_kpi(token=None):
+        return {"data": [{"month": "2024-01-01", "value": 1}]}
+
+    main._KPI_CACHE.clear()
+    endpoint = main.cached_kpi(get_test_kpi)
+    yield endpoint
+    main._KPI_HANDLERS.remove(get_test_kpi)
+    main._KPI_CACHE.clear()
+
+def call(endpoint, **headers):
+    return asyncio.run(endpoint(make_request(**headers), token={}))
+
+def test_kpi_identity_and_gzip_variants(kpi_endpoint):
+    plain = call(kpi_endpoint)
+    zipped = call(kpi_endpoint, accept_encoding="gzip")
+    assert "content-encoding" not in plain.headers
+    assert zipped.headers["content-encoding"] == "gzip"
+    assert gzip.decompress(zipped.body) == plain.body
+    assert zipped.headers["etag"] == plain.headers["etag"][:-1] + '-gz"'
+    assert plain.headers["vary"] == zipped.headers["vary"] == "Accept-Encoding"
+
+def test_kpi_refused_gzip_gets_identity(kpi_endpoint):
+    response = call(kpi_endpoint, accept_encoding="gzip;q=0, *")
+    assert "content-encoding" not in response.headers
+    assert not response.headers["etag"].endswith('-gz"')
+
+@pytest.mark.parametrize("sent_variant", ["identity", "gzip"])
+@pytest.mark.parametrize("accept_encoding", ["identity", "gzip"])
+def test_kpi_304_for_either_etag(kpi_endpoint, sent_variant, accept_encoding):
+    plain_etag = call(kpi_endpoint).headers["etag"]
+    gz_etag = call(kpi_endpoint, accept_encoding="gzip").headers["etag"]
+    sent = gz_etag if sent_variant == "gzip" else plain_etag
+    response = call(kpi_endpoint, accept_encoding=accept_encoding, if_none_match=f'"other", {sent}')
+    assert response.status_code == 304
+    assert response.body == b""
+    # The 304 names the variant this request would have been served
+    assert response.headers["etag"] == (gz_etag if accept_encoding == "gzip" else plain_etag)
+
+def test_kpi_stale_etag_gets_body(kpi_endpoint):
+    response = call(kpi_endpoint, if_none_match='"stale"')
+    assert response.status_code == 200
+    assert response.body
+
+@pytest.fixture
+def employees_db(tmp_path, monkeypatch):
+    """Temporary DuckDB file with silver_employees and its unique id index, as the ETL builds it"""
+    db_path = str(tmp_path / "etl.db")
+    with duckdb.connect(db_path) as conn:
+        conn.execute("""
+            CREATE TABLE silver_employees (client_employee_id VARCHAR, first_name VARCHAR,
+                last_name VARCHAR, department_name VARCHAR, date_joined VARCHAR)
+        """)
+        conn.execute("CREATE UNIQUE INDEX ix_silver_employees_cid ON silver_employees(client_employee_id)")
+        conn.execute("INSERT INTO silver_employees VALUES ('E1', 'Old', 'Name', 'Ops', '2020-01-01')")
+    monkeypatch.setattr(main, "DB_PATH", db_path)
+    monkeypatch.setattr(main, "BATCH_SIZE", 2)
+    monkeypatch.setattr(main, "_CONN", None)
+    yield db_path
+    if main._CONN is not None:
+        main._CONN.close()
+
+def employee(emp_id, first_name, department="Eng"):
+    return main.EmployeeCreate(client_employee_id=emp_id, first_name=first_name, last_name="Doe",
+                               department_name=department, date_joined="2024-01-01")
+
+def test_bulk_upsert_inserts_updates_and_dedupes(employees_db):
+    bulk = main.EmployeeBulkCreate(employees=[
+        employee("E1", "New"),
+        employee("E2", "First"),
+        employee("E3", "Third"),
+        employee("E2", "Last", department="Sales"),
+    ])
+    result = main.create_employees_bulk(bulk, token={})
+    assert result == {"message": "3 employees created or updated"}
+    with duckdb.connect(employees_db, read_only=True) as conn:
+        rows = conn.execute("""
+            SELECT client_employee_id, first_name, department_name
+            FROM silver_employees ORDER BY client_employee_id
+        """).fetchall()
+    assert rows == [("E1", "New", "Eng"), ("E2", "Last", "Sales"), ("E3", "Third", "Eng")]
+
+def test_bulk_upsert_rejects_empty_batch(employees_db):
+    with pytest.raises(main.HTTPException) as error:
+        main.create_employees_bulk(main.EmployeeBulkCreate(employees=[]), token={})
+    assert error.value.status_code == 400